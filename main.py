@@ -1,13 +1,20 @@
+import numpy as np
 import pandas as pd
-import re
+import pyarrow as pa
+from pyarrow import csv
 import cProfile
 import pstats
 import io
-import matplotlib
-import matplotlib.pyplot as plt
 import xlsxwriter
 
-matplotlib.use('Agg')
+# Translation table deleting the characters Excel does not allow in sheet names
+INVALID_SHEET_NAME_CHARS = str.maketrans('', '', '\\/*?[]:')
+
+# Names of the summary sheets written after the machine sheets
+INDEX_SHEET_NAME = 'Index'
+UNIQUE_FAULTS_SHEET_NAME = 'Unique Faults'
+TOTAL_DURATION_SHEET_NAME = 'Total Duration'
+SUMMARY_SHEET_NAMES = (INDEX_SHEET_NAME, UNIQUE_FAULTS_SHEET_NAME, TOTAL_DURATION_SHEET_NAME)
 
 
 def sanitize_sheet_name(name):
@@ -19,7 +26,7 @@ def sanitize_sheet_name(name):
     Returns:
         str: The sanitized sheet name.
     """
-    sanitized = re.sub(r'[\\/*?[\]:]', '', name).strip()
+    sanitized = name.translate(INVALID_SHEET_NAME_CHARS).strip()
     return sanitized[:25]
 
 
@@ -31,126 +38,258 @@ def auto_adjust_column_widths(df, worksheet):
         worksheet (xlsxwriter.Worksheet): The worksheet to adjust.
     """
     for idx, col in enumerate(df.columns):
-        max_length = max(df[col].astype(str).map(len).max(), len(col)) + 2  # Adding a little extra space
+        # Measure string lengths in a single vectorized NumPy call instead of calling len per cell
+        cell_lengths = np.char.str_len(df[col].to_numpy().astype(str))
+        max_length = max(int(cell_lengths.max(initial=0)), len(col)) + 2  # Adding a little extra space
         worksheet.set_column(idx, idx, max_length)
 
 
-def create_bar_chart(data, title, x_label, y_label):
-    """Create a bar chart using Matplotlib and return it as an in-memory image.
+def select_top_faults(df, col, n=10):
+    """Find the rows with the n largest values of a column for every machine in one pass.
+
+    Sorts the whole frame once by machine, descending value, and row position, then slices the
+    first n rows of each machine's run, so no per-machine DataFrame is built to rank the faults.
 
     Args:
-        data (pd.Series): The data to plot.
-        title (str): The title of the chart.
-        x_label (str): The label for the x-axis.
-        y_label (str): The label for the y-axis.
+        df (pd.DataFrame): The aggregated DataFrame with a categorical 'D_MachineName' column.
+        col (str): The column to rank the rows by.
+        n (int): The number of rows to select per machine.
 
     Returns:
-        io.BytesIO: The in-memory image of the chart.
+        dict: The row positions of each machine's top n rows, keyed by machine category code.
     """
-    fig, ax = plt.subplots(figsize=(10, 6))
-    ax.bar(data.index, data.values)
-    ax.set_title(title)
-    ax.set_xlabel(x_label)
-    ax.set_ylabel(y_label)
-    plt.xticks(rotation=30, ha='right')
-    plt.tight_layout()
+    machine_codes = df['D_MachineName'].cat.codes.to_numpy()
+    values = df[col].to_numpy(dtype=np.float64)
+    if len(values) == 0:
+        return {}
+    positions = np.arange(len(values))
 
-    image_stream = io.BytesIO()
-    plt.savefig(image_stream, format='png')
-    plt.close(fig)
-    image_stream.seek(0)
-    return image_stream
+    # Ties keep their original row order, matching DataFrame.nlargest
+    order = np.lexsort((positions, -values, machine_codes))
+    sorted_codes = machine_codes[order]
+    starts = np.flatnonzero(np.r_[True, sorted_codes[1:] != sorted_codes[:-1]])
+    ends = np.r_[starts[1:], len(order)]
+    return {sorted_codes[start]: order[start:min(start + n, end)] for start, end in zip(starts, ends)}
 
 
-def process_faults_file():
-    """Process the faults CSV file and create an Excel file with separate sheets for each machine."""
-    file_name = 'faults.csv'
-    df = pd.read_csv(file_name)
+def unique_sheet_name(name, used_sheet_names):
+    """Make a sheet name unique by appending a numbered suffix if it is already in use.
 
-    # Convert 'T_TotalDuration' and 'T_TotalOccur' to numeric, forcing errors to NaN
-    df['T_TotalDuration'] = pd.to_numeric(df['T_TotalDuration'], errors='coerce')
-    df['T_TotalOccur'] = pd.to_numeric(df['T_TotalOccur'], errors='coerce')
+    Excel compares sheet names case-insensitively, and xlsxwriter raises on duplicates, so machines whose
+    sanitized names collide with each other or with a summary sheet each get their own sheet.
 
-    # Drop rows with NaN values in 'T_TotalDuration' or 'T_TotalOccur'
-    df = df.dropna(subset=['T_TotalDuration', 'T_TotalOccur'])
+    Args:
+        name (str): The sanitized sheet name.
+        used_sheet_names (set): The lowercased sheet names already taken, updated with the returned name.
+
+    Returns:
+        str: The unique sheet name.
+    """
+    unique_name, suffix = name, 2
+    while unique_name.lower() in used_sheet_names:
+        unique_name = f'{name[:22]}_{suffix}'
+        suffix += 1
+    used_sheet_names.add(unique_name.lower())
+    return unique_name
+
+
+def write_table(worksheet, df, startrow=0):
+    """Write the header and values of a DataFrame to a worksheet, bypassing DataFrame.to_excel.
+
+    Args:
+        worksheet (xlsxwriter.Worksheet): The worksheet to write to.
+        df (pd.DataFrame): The DataFrame containing the data.
+        startrow (int): The row to write the header to (zero indexed).
+    """
+    worksheet.write_row(startrow, 0, list(df.columns))
+    for idx, col in enumerate(df.columns):
+        worksheet.write_column(startrow + 1, idx, df[col].to_numpy().tolist())
+
+
+def write_summary_sheet(workbook, df, sheet_name):
+    """Write the header and values of a DataFrame to a new worksheet.
+
+    Args:
+        workbook (xlsxwriter.Workbook): The workbook to add the worksheet to.
+        df (pd.DataFrame): The DataFrame containing the data.
+        sheet_name (str): The name of the new worksheet.
 
-    # Ensure 'D_MachineName', 'D_MsgDesc', and 'D_MsgCode' are strings and fill NaN values with a placeholder
-    df['D_MachineName'] = df['D_MachineName'].astype(str).fillna('Unknown')
-    df['D_StateDesc'] = df['D_StateDesc'].astype(str).fillna('Unknown')
-    df['D_MsgDesc'] = df['D_MsgDesc'].astype(str).fillna('Unknown')
-    df['D_MsgCode'] = df['D_MsgCode'].astype(str).fillna('Unknown')
+    Returns:
+        xlsxwriter.Worksheet: The written worksheet.
+    """
+    worksheet = workbook.add_worksheet(sheet_name)
+    write_table(worksheet, df)
+    return worksheet
 
-    # Combine 'D_MsgDesc' and 'D_MsgCode' for labeling
-    df['Fault_Description'] = df['D_MsgDesc'] + " (" + df['D_MsgCode'] + ")"
 
-    # Aggregate data by 'D_MsgCode' and sum 'T_TotalDuration' and 'T_TotalOccur'
-    aggregated_df_total_duration = df.groupby(
-        ['D_MachineName', 'D_StateDesc', 'D_MsgCode', 'D_MsgDesc', 'Fault_Description']
-    ).agg({'T_TotalDuration': 'sum'}).reset_index()
+def create_bar_chart(workbook, sheet_name, first_row, last_row, label_col, value_col, title, x_label, y_label):
+    """Create a native Excel column chart from a range of cells in a worksheet.
 
-    aggregated_df_total_occur = df.groupby(
-        ['D_MachineName', 'D_StateDesc', 'D_MsgCode', 'D_MsgDesc', 'Fault_Description']
-    ).agg({'T_TotalOccur': 'sum'}).reset_index()
+    Args:
+        workbook (xlsxwriter.Workbook): The workbook to add the chart to.
+        sheet_name (str): The name of the worksheet holding the data.
+        first_row (int): The first data row of the range (zero indexed).
+        last_row (int): The last data row of the range (zero indexed).
+        label_col (int): The column holding the category labels.
+        value_col (int): The column holding the values to plot.
+        title (str): The title of the chart.
+        x_label (str): The label for the x-axis.
+        y_label (str): The label for the y-axis.
+
+    Returns:
+        xlsxwriter.chart.Chart: The chart, ready to be inserted into a worksheet.
+    """
+    chart = workbook.add_chart({'type': 'column'})
+    chart.add_series({
+        'name': y_label,
+        'categories': [sheet_name, first_row, label_col, last_row, label_col],
+        'values': [sheet_name, first_row, value_col, last_row, value_col],
+    })
+    chart.set_title({'name': title})
+    chart.set_x_axis({'name': x_label, 'num_font': {'rotation': -30}})
+    chart.set_y_axis({'name': y_label})
+    chart.set_legend({'none': True})
+    chart.set_size({'width': 1000, 'height': 600})
+    return chart
 
-    # Calculate the number of unique faults per station
-    unique_faults_per_station = df.groupby('D_MachineName').size().reset_index(name='Unique Faults')
-    sorted_unique_faults_per_station = unique_faults_per_station.sort_values(by='Unique Faults', ascending=False)
 
-    # Aggregate total duration per station
-    total_duration_per_station = aggregated_df_total_duration.groupby('D_MachineName')['T_TotalDuration'].sum().reset_index()
-    sorted_total_duration_per_station = total_duration_per_station.sort_values(by='T_TotalDuration', ascending=False)
+def process_faults_file():
+    """Process the faults CSV file and create an Excel file with separate sheets for each machine."""
+    file_name = 'faults.csv'
+    string_columns = ['D_MachineName', 'D_StateDesc', 'D_MsgCode', 'D_MsgDesc']
+    numeric_columns = ['T_TotalDuration', 'T_TotalOccur']
+
+    # Read only the columns that are used with Arrow's multithreaded CSV reader into Arrow-backed columns,
+    # parsing the descriptive columns as strings so codes such as '007' keep their exact text
+    convert_options = csv.ConvertOptions(
+        include_columns=string_columns + numeric_columns,
+        column_types={col: pa.string() for col in string_columns},
+        strings_can_be_null=True
+    )
+    df = csv.read_csv(file_name, convert_options=convert_options).to_pandas(types_mapper=pd.ArrowDtype)
+
+    # Convert 'T_TotalDuration' and 'T_TotalOccur' to numeric, forcing errors to missing values
+    for col in numeric_columns:
+        if not pd.api.types.is_numeric_dtype(df[col]):
+            df[col] = pd.to_numeric(df[col], errors='coerce', dtype_backend='pyarrow')
+
+    # Drop rows with NaN values in 'T_TotalDuration' or 'T_TotalOccur'
+    df = df.dropna(subset=numeric_columns)
+
+    # Downcast the occurrence counts to the smallest unsigned integer type to cut groupby memory traffic
+    df['T_TotalOccur'] = pd.to_numeric(df['T_TotalOccur'], downcast='unsigned')
+
+    # Fill missing 'D_MachineName', 'D_StateDesc', and 'D_MsgCode' values with a placeholder
+    key_columns = ['D_MachineName', 'D_StateDesc', 'D_MsgCode']
+    df[key_columns] = df[key_columns].fillna('Unknown')
+
+    # Convert the grouping columns to categoricals so groupby hashes integer codes instead of strings
+    for col in key_columns:
+        df[col] = df[col].astype('category')
+
+    # Look up each 'D_MsgCode' description from rows that actually have one, before any placeholder is filled in
+    msg_desc_lookup = df[['D_MsgCode', 'D_MsgDesc']].dropna(subset=['D_MsgDesc']).drop_duplicates('D_MsgCode')
+
+    # Aggregate data by 'D_MsgCode' and sum 'T_TotalDuration' and 'T_TotalOccur' in a single pass
+    aggregated_df = df.groupby(
+        key_columns,
+        sort=False, observed=True
+    ).agg(
+        T_TotalDuration=('T_TotalDuration', 'sum'),
+        T_TotalOccur=('T_TotalOccur', 'sum')
+    ).reset_index()
+
+    # Reattach 'D_MsgDesc', which is determined by 'D_MsgCode', using a placeholder for codes with no description
+    aggregated_df = aggregated_df.merge(msg_desc_lookup, on='D_MsgCode', how='left')
+    aggregated_df.insert(3, 'D_MsgDesc', aggregated_df.pop('D_MsgDesc').fillna('Unknown'))
+
+    # Combine 'D_MsgDesc' and 'D_MsgCode' for labeling, once per aggregated row instead of per raw row
+    aggregated_df.insert(
+        4, 'Fault_Description',
+        aggregated_df['D_MsgDesc'].astype('string[pyarrow]') + " ("
+        + aggregated_df['D_MsgCode'].astype('string[pyarrow]') + ")"
+    )
+
+    # Roll up the number of unique faults and the total duration per station from the aggregated data in one pass
+    per_station = aggregated_df.groupby('D_MachineName', sort=False, observed=True).agg(
+        Unique_Faults=('D_MsgCode', 'nunique'),
+        T_TotalDuration=('T_TotalDuration', 'sum')
+    ).reset_index().rename(columns={'Unique_Faults': 'Unique Faults'})
+    sorted_unique_faults_per_station = per_station[['D_MachineName', 'Unique Faults']].sort_values(
+        by='Unique Faults', ascending=False
+    )
+    sorted_total_duration_per_station = per_station[['D_MachineName', 'T_TotalDuration']].sort_values(
+        by='T_TotalDuration', ascending=False
+    )
 
     # Create an Excel writer object
     excel_file = 'faults_per_machine.xlsx'
 
-    with pd.ExcelWriter(excel_file, engine='xlsxwriter') as writer:
+    # Skip the formula and URL checks on every string cell, and write non-finite numbers as Excel errors
+    # since the tables are written directly rather than through to_excel
+    engine_kwargs = {'options': {
+        'strings_to_formulas': False,
+        'strings_to_urls': False,
+        'nan_inf_to_errors': True
+    }}
+
+    with pd.ExcelWriter(excel_file, engine='xlsxwriter', engine_kwargs=engine_kwargs) as writer:
         # Initialize list for index sheet
         index_data = []
 
-        # Get unique machine names
-        unique_machines = aggregated_df_total_duration['D_MachineName'].unique()
-        
-        # Write data for each machine to a separate sheet
-        for machine in unique_machines:
-            machine_df_duration = aggregated_df_total_duration[aggregated_df_total_duration['D_MachineName'] == machine].sort_values(
-                by='T_TotalDuration', ascending=False
-            ).head(10)  # Grab top 10 by duration
-            machine_df_occurrences = aggregated_df_total_occur[aggregated_df_total_occur['D_MachineName'] == machine].sort_values(
-                by='T_TotalOccur', ascending=False
-            ).head(10)  # Grab top 10 by occurrences
+        # Track sheet names case-insensitively, as Excel does, starting with the summary sheets
+        used_sheet_names = {name.lower() for name in SUMMARY_SHEET_NAMES}
+
+        # Rank the faults of every machine at once
+        top_duration_rows = select_top_faults(aggregated_df, 'T_TotalDuration')
+        top_occurrence_rows = select_top_faults(aggregated_df, 'T_TotalOccur')
+        machine_names = aggregated_df['D_MachineName'].cat.categories
+
+        # Write data for each machine to a separate sheet, in alphabetical order
+        for code in np.argsort(machine_names.to_numpy()):
+            if code not in top_duration_rows:
+                continue
+            machine = machine_names[code]
+            machine_df_duration = aggregated_df.iloc[top_duration_rows[code]].drop(columns='T_TotalOccur')  # Grab top 10 by duration
+            machine_df_occurrences = aggregated_df.iloc[top_occurrence_rows[code]].drop(columns='T_TotalDuration')  # Grab top 10 by occurrences
             
             # Sanitize sheet name
             sheet_name = sanitize_sheet_name(machine)
             
-            # Write duration data to the sheet
-            machine_df_duration.to_excel(writer, sheet_name=sheet_name, startrow=1, index=False, header=True)
+            # Give each machine its own sheet, never clashing with another machine or a summary sheet
+            sheet_name = unique_sheet_name(sheet_name, used_sheet_names)
+            worksheet = writer.book.add_worksheet(sheet_name)
+
+            # Write duration data and its title to the sheet
+            worksheet.write(0, 0, 'Total Duration (Top 10)')
+            write_table(worksheet, machine_df_duration, startrow=1)
             
-            # Write occurrences data to the sheet below the duration data
+            # Write occurrences data and its title to the sheet below the duration data
             startrow = len(machine_df_duration) + 4
-            machine_df_occurrences.to_excel(writer, sheet_name=sheet_name, startrow=startrow, index=False, header=True)
-            
-            # Add titles to the tables
-            worksheet = writer.sheets[sheet_name]
-            worksheet.write(0, 0, 'Total Duration (Top 10)')
             worksheet.write(startrow-1, 0, 'Total Occurrences (Top 10)')
+            write_table(worksheet, machine_df_occurrences, startrow=startrow)
             
             # Auto-adjust column widths
             auto_adjust_column_widths(machine_df_duration, worksheet)
             auto_adjust_column_widths(machine_df_occurrences, worksheet)
             
-            # Create bar charts with Matplotlib and insert as images
-            duration_image = create_bar_chart(
-                machine_df_duration.set_index('Fault_Description')['T_TotalDuration'],
-                f'Top 10 Durations for {sheet_name}', 'Fault Description', 'Total Duration'
+            # Create native bar charts referencing the table data and insert them into the worksheet
+            duration_title = f'Top 10 Durations for {sheet_name}'
+            occurrences_title = f'Top 10 Occurrences for {sheet_name}'
+            duration_chart = create_bar_chart(
+                writer.book, sheet_name, 2, len(machine_df_duration) + 1,
+                machine_df_duration.columns.get_loc('Fault_Description'),
+                machine_df_duration.columns.get_loc('T_TotalDuration'),
+                duration_title, 'Fault Description', 'Total Duration'
             )
-            occurrences_image = create_bar_chart(
-                machine_df_occurrences.set_index('Fault_Description')['T_TotalOccur'],
-                f'Top 10 Occurrences for {sheet_name}', 'Fault Description', 'Total Occurrences'
+            occurrences_chart = create_bar_chart(
+                writer.book, sheet_name, startrow + 1, startrow + len(machine_df_occurrences),
+                machine_df_occurrences.columns.get_loc('Fault_Description'),
+                machine_df_occurrences.columns.get_loc('T_TotalOccur'),
+                occurrences_title, 'Fault Description', 'Total Occurrences'
             )
-            
-            # Insert images into the worksheet
-            worksheet.insert_image(20, 0, f'{sheet_name}_duration.png', {'image_data': duration_image, 'x_scale': 1, 'y_scale': 1})
-            worksheet.insert_image(20, 10, f'{sheet_name}_occurrences.png', {'image_data': occurrences_image, 'x_scale': 1, 'y_scale': 1})
+            worksheet.insert_chart(20, 0, duration_chart)
+            worksheet.insert_chart(20, 10, occurrences_chart)
 
             # Set sheet zoom level to 50%
             worksheet.set_zoom(50)
@@ -161,45 +300,36 @@ def process_faults_file():
         # Create index DataFrame
         index_df = pd.DataFrame(index_data, columns=['Machine Name', 'Sheet Name'])
 
-        # Write index sheet
-        index_df.to_excel(writer, sheet_name='Index', index=False)
-        worksheet = writer.sheets['Index']
-        
-        # Create hyperlinks
-        for i, sheet in enumerate(index_df['Sheet Name']):
+        # Write index sheet with hyperlinks
+        worksheet = writer.book.add_worksheet(INDEX_SHEET_NAME)
+        worksheet.write_row(0, 0, list(index_df.columns))
+        for i, (machine, sheet) in enumerate(index_data):
+            worksheet.write(i + 1, 0, machine)
             worksheet.write_url(i + 1, 1, f"internal:'{sheet}'!A1", string=sheet)
-            worksheet.write(i + 1, 0, index_df.at[i, 'Machine Name'])
         
         # Auto-adjust column widths for index sheet
         auto_adjust_column_widths(index_df, worksheet)
 
+        # Make the index sheet the active and first visible sheet when the workbook is opened
+        worksheet.activate()
+        worksheet.set_first_sheet()
+
         # Write sorted unique faults per station sheet
-        sorted_unique_faults_per_station.to_excel(writer, sheet_name='Unique Faults', index=False)
-        worksheet = writer.sheets['Unique Faults']
+        worksheet = write_summary_sheet(writer.book, sorted_unique_faults_per_station, UNIQUE_FAULTS_SHEET_NAME)
         auto_adjust_column_widths(sorted_unique_faults_per_station, worksheet)
 
         # Write sorted total duration per station sheet
-        sorted_total_duration_per_station.to_excel(writer, sheet_name='Total Duration', index=False)
-        worksheet = writer.sheets['Total Duration']
+        worksheet = write_summary_sheet(writer.book, sorted_total_duration_per_station, TOTAL_DURATION_SHEET_NAME)
         auto_adjust_column_widths(sorted_total_duration_per_station, worksheet)
 
         # Set zoom level to 50% for summary sheets
-        worksheet = writer.sheets['Index']
+        worksheet = writer.sheets[INDEX_SHEET_NAME]
         worksheet.set_zoom(50)
-        worksheet = writer.sheets['Unique Faults']
+        worksheet = writer.sheets[UNIQUE_FAULTS_SHEET_NAME]
         worksheet.set_zoom(50)
-        worksheet = writer.sheets['Total Duration']
+        worksheet = writer.sheets[TOTAL_DURATION_SHEET_NAME]
         worksheet.set_zoom(50)
 
-    # Save the workbook and reopen to set the index sheet as the first sheet
-    workbook = writer.book
-    workbook.filename = excel_file
-    workbook.close()
-
-    # Reopen the workbook and set the index sheet as the first sheet
-    with pd.ExcelWriter(excel_file, engine='openpyxl', mode='a') as writer:
-        writer.book.active = writer.book.sheetnames.index('Index')
-
     print(f"Excel file with separate sheets for each machine, an index sheet, a sorted unique faults sheet, and a sorted total duration sheet has been saved as '{excel_file}'.")
 
 